@@ -1,98 +1,152 @@
-import os, json, tempfile, shutil, subprocess, logging, base64
+import os, logging, base64
+import urllib.request
+from urllib.parse import quote
 import boto3
-from typing import Dict, Any
+import orjson
+from aws_secretsmanager_caching import SecretCache, SecretCacheConfig
+from botocore.config import Config
+from playbook_runner import INVENTORY_TEMPLATE, SSH_COMMON_ARGS, run_streaming, write_extra_vars
+from typing import Dict, Any, Optional, Tuple
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
 
-SECRETS_CLIENT = boto3.client('secretsmanager')
-SSM_CLIENT = boto3.client('ssm')
-
-def _copy_embedded_ansible(work_dir: str) -> str:
+# Keep-alive connections avoid a fresh TLS handshake per API call
+BOTO_CONFIG = Config(
+    max_pool_connections=25,
+    retries={"max_attempts": 2, "mode": "standard"},
+    tcp_keepalive=True
+)
+
+SECRETS_CLIENT = boto3.client('secretsmanager', config=BOTO_CONFIG)
+SSM_CLIENT = boto3.client('ssm', config=BOTO_CONFIG)
+
+# Set when the AWS Parameters and Secrets Lambda Extension layer is attached
+# (see deploy.sh); secrets are then served from its local in-sandbox cache
+SECRETS_EXTENSION_PORT = os.getenv("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT")
+
+# Extracted ansible tree is kept for the container lifetime; only the
+# hosts inventory is rewritten per invocation
+WARM_DIR = "/tmp/ansible_warm"
+_ANSIBLE_DIR = None
+# (key_path, key material) of the SSH key already written in this container
+_SSH_KEY_STATE: Optional[Tuple[str, str]] = None
+
+# ansible-playbook environment; static for the container, so built once at import
+BASE_ENV = {
+    **os.environ,
+    "ANSIBLE_HOST_KEY_CHECKING": "False",
+    "ANSIBLE_STDOUT_CALLBACK": os.environ.get("ANSIBLE_STDOUT_CALLBACK", "yaml"),
+    "ANSIBLE_PIPELINING": "True",
+    "ANSIBLE_SSH_PIPELINING": "True",
+    "ANSIBLE_GATHERING": "explicit"
+}
+
+# Secrets are cached per container, refreshed on access after 300s
+_SECRET_CACHE = SecretCache(
+    config=SecretCacheConfig(max_cache_size=64, secret_refresh_interval=300),
+    client=SECRETS_CLIENT
+)
+
+def _ensure_ansible_dir() -> str:
+    global _ANSIBLE_DIR
+    if _ANSIBLE_DIR and os.path.isdir(_ANSIBLE_DIR):
+        return _ANSIBLE_DIR
+    import shutil
     base_dir = os.path.dirname(__file__)
     embedded_dir = os.path.join(base_dir, "ansible")
     bundle = os.path.join(base_dir, "ansible_bundle.zip")
-    target = os.path.join(work_dir, "ansible")
+    target = os.path.join(WARM_DIR, "ansible")
     if os.path.isdir(embedded_dir):
-        shutil.copytree(embedded_dir, target)
+        shutil.copytree(embedded_dir, target, dirs_exist_ok=True)
         logger.info("Copied embedded ansible directory")
     elif os.path.isfile(bundle):
-        shutil.unpack_archive(bundle, work_dir)
+        shutil.unpack_archive(bundle, WARM_DIR)
         logger.info("Unpacked ansible_bundle.zip")
         # After unzip we expect ansible/ present
         if not os.path.isdir(target):
             raise RuntimeError("ansible directory missing after unzip")
     else:
         raise RuntimeError("No embedded ansible (directory or zip) found in package")
+    _ANSIBLE_DIR = target
     return target
 
+def _extension_get(path: str) -> Dict[str, Any]:
+    req = urllib.request.Request(
+        f"http://localhost:{SECRETS_EXTENSION_PORT}{path}",
+        headers={"X-Aws-Parameters-Secrets-Token": os.environ["AWS_SESSION_TOKEN"]}
+    )
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        return orjson.loads(resp.read())
+
+def _cached_secret(secret_id: str) -> str:
+    if SECRETS_EXTENSION_PORT:
+        resp = _extension_get(f"/secretsmanager/get?secretId={quote(secret_id, safe='')}")
+        if resp.get("SecretString") is not None:
+            return resp["SecretString"]
+        # The HTTP API returns SecretBinary base64-encoded, boto3 returns it decoded
+        return base64.b64decode(base64.b64decode(resp["SecretBinary"])).decode()
+    material = _SECRET_CACHE.get_secret_string(secret_id)
+    if material is None:
+        material = base64.b64decode(_SECRET_CACHE.get_secret_binary(secret_id)).decode()
+    return material
+
 def _get_json_secret(secret_id: str) -> Dict[str, Any]:
-    resp = SECRETS_CLIENT.get_secret_value(SecretId=secret_id)
-    if 'SecretString' in resp:
-        return json.loads(resp['SecretString'])
-    return json.loads(base64.b64decode(resp['SecretBinary']).decode())
+    return orjson.loads(_cached_secret(secret_id))
 
 def _write_ssh_key(work_dir: str, secret_id: str) -> str:
-    key_secret = SECRETS_CLIENT.get_secret_value(SecretId=secret_id)
-    key_material = key_secret.get('SecretString') or base64.b64decode(key_secret['SecretBinary']).decode()
+    global _SSH_KEY_STATE
+    key_material = _cached_secret(secret_id)
     key_path = os.path.join(work_dir, "id_rsa")
+    if _SSH_KEY_STATE == (key_path, key_material) and os.path.isfile(key_path):
+        return key_path
     with open(key_path, "w") as f:
         f.write(key_material.strip() + "\n")
     os.chmod(key_path, 0o600)
     logger.info("SSH key written")
+    _SSH_KEY_STATE = (key_path, key_material)
     return key_path
 
 def _create_inventory(ansible_dir: str, host: str, user: str, site: str) -> str:
     hosts_path = os.path.join(ansible_dir, "hosts")
-    content = f"""[vm]
-{host} ansible_user={user} ansible_connection=ssh ansible_python_interpreter=/usr/libexec/platform-python
-
-[vm:vars]
-site={site}
-ansible_ssh_common_args=-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o IdentitiesOnly=yes
-"""
     with open(hosts_path, "w") as f:
-        f.write(content)
+        f.write(INVENTORY_TEMPLATE.format_map({"host": host, "user": user, "site": site}))
     return hosts_path
 
 def _run_playbook(ansible_dir: str, extra: Dict[str, Any], ssh_key_path: str) -> Dict[str, Any]:
-    env = os.environ.copy()
-    env["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-    env["ANSIBLE_STDOUT_CALLBACK"] = env.get("ANSIBLE_STDOUT_CALLBACK", "yaml")
-
-    extra_args = []
-    for k, v in extra.items():
-        if v is None:
-            continue
-        extra_args.extend(["-e", f"{k}={v}"])
+    extra_vars_path = write_extra_vars(ansible_dir, {k: v for k, v in extra.items() if v is not None})
 
     cmd = [
         "ansible-playbook",
         "-i", os.path.join(ansible_dir, "hosts"),
         "main.yml",
-        "--ssh-common-args", "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o IdentitiesOnly=yes",
-        "-vv"
-    ] + extra_args
+        "--ssh-common-args", SSH_COMMON_ARGS,
+        "-e", f"@{extra_vars_path}"
+    ]
 
     logger.info("Executing: %s", " ".join(cmd))
-    result = subprocess.run(cmd, cwd=ansible_dir, capture_output=True, text=True, timeout=900, env=env)
+    try:
+        returncode, stdout, stderr = run_streaming(cmd, ansible_dir, BASE_ENV, timeout=900)
+    finally:
+        # Holds credentials; don't leave it in the warm tree between invocations
+        os.remove(extra_vars_path)
     return {
-        "returncode": result.returncode,
-        "stdout": result.stdout[-20000:],
-        "stderr": result.stderr[-20000:],
-        "success": result.returncode == 0
+        "returncode": returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "success": returncode == 0
     }
 
 def lambda_handler(event, context):
     try:
-        body = json.loads(event.get("body", "{}")) if isinstance(event, dict) and "body" in event else event
+        body = orjson.loads(event.get("body", "{}")) if isinstance(event, dict) and "body" in event else event
         service_name = body.get("service_name")
         jar_timestamp = body.get("jar_timestamp")
         site = body.get("site", "sit1").lower()
         app_user = body.get("app_user", "appadm")
 
         if not service_name or not jar_timestamp:
-            return {"statusCode": 400, "body": json.dumps({"error": "service_name and jar_timestamp required"})}
+            return {"statusCode": 400, "body": orjson.dumps({"error": "service_name and jar_timestamp required"}).decode()}
 
         # Secrets layout (mirrors working GitHub Action):
         # demoapp/vm/{site}   -> JSON with VM_HOSTNAME, VM_USERNAME, DATASOURCE_URL, DB_USERNAME, DB_PASSWORD
@@ -107,56 +161,52 @@ def lambda_handler(event, context):
         db_username = vm_data.get("DB_USERNAME", "")
         db_password = vm_data.get("DB_PASSWORD", "")
 
-        work_dir = tempfile.mkdtemp(prefix="ansible_exec_")
-        try:
-            ansible_dir = _copy_embedded_ansible(work_dir)
-            ssh_key_path = _write_ssh_key(work_dir, ssh_key_secret_id)
-            _create_inventory(ansible_dir, vm_host, vm_user, site)
-
-            extra_vars = {
-                "service_name": service_name,
-                "jar_timestamp": jar_timestamp,
-                "aws_s3_bucket_repository": os.getenv("AWS_S3_BUCKET_REPOSITORY"),
-                "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID", ""),
-                "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY", ""),
-                "aws_default_region": os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
-                "site": site,
-                "app_user": app_user,
-                "datasource_url": datasource_url,
-                "db_username": db_username,
-                "db_password": db_password
-            }
-
-            result = _run_playbook(ansible_dir, extra_vars, ssh_key_path)
-            if result["success"]:
-                return {
-                    "statusCode": 200,
-                    "body": json.dumps({
-                        "message": "Deployment succeeded",
-                        "service_name": service_name,
-                        "timestamp": jar_timestamp,
-                        "site": site,
-                        "target_vm": vm_host,
-                        "ansible_stdout_tail": result["stdout"][-2000:]
-                    })
-                }
+        ansible_dir = _ensure_ansible_dir()
+        ssh_key_path = _write_ssh_key(WARM_DIR, ssh_key_secret_id)
+        _create_inventory(ansible_dir, vm_host, vm_user, site)
+
+        extra_vars = {
+            "service_name": service_name,
+            "jar_timestamp": jar_timestamp,
+            "aws_s3_bucket_repository": os.getenv("AWS_S3_BUCKET_REPOSITORY"),
+            "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID", ""),
+            "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY", ""),
+            "aws_default_region": os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+            "site": site,
+            "app_user": app_user,
+            "datasource_url": datasource_url,
+            "db_username": db_username,
+            "db_password": db_password
+        }
+
+        result = _run_playbook(ansible_dir, extra_vars, ssh_key_path)
+        if result["success"]:
             return {
-                "statusCode": 500,
-                "body": json.dumps({
-                    "error": "Deployment failed",
-                    "stderr_tail": result["stderr"][-4000:],
-                    "stdout_tail": result["stdout"][-4000:]
-                })
+                "statusCode": 200,
+                "body": orjson.dumps({
+                    "message": "Deployment succeeded",
+                    "service_name": service_name,
+                    "timestamp": jar_timestamp,
+                    "site": site,
+                    "target_vm": vm_host,
+                    "ansible_stdout_tail": result["stdout"][-2000:]
+                }).decode()
             }
-        finally:
-            shutil.rmtree(work_dir, ignore_errors=True)
+        return {
+            "statusCode": 500,
+            "body": orjson.dumps({
+                "error": "Deployment failed",
+                "stderr_tail": result["stderr"][-4000:],
+                "stdout_tail": result["stdout"][-4000:]
+            }).decode()
+        }
     except Exception as e:
         logger.exception("Unhandled error")
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        return {"statusCode": 500, "body": orjson.dumps({"error": str(e)}).decode()}
 
 if __name__ == "__main__":
-    print(json.dumps(lambda_handler({
+    print(orjson.dumps(lambda_handler({
         "service_name": "discovery-service",
         "jar_timestamp": "20250122-120000",
         "site": "sit1"
-    }, None), indent=2))
+    }, None), option=orjson.OPT_INDENT_2).decode())
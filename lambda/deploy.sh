@@ -30,6 +30,7 @@ PACKAGE_ONLY=false
 DEPLOY_ONLY=false
 UPLOAD_ANSIBLE=false
 ANSIBLE_S3_BUCKET=""
+SECRETS_EXTENSION_LAYER_ARN="${SECRETS_EXTENSION_LAYER_ARN:-}"
 
 while [[ $# -gt 0 ]]; do
     case $1 in
@@ -49,6 +50,10 @@ while [[ $# -gt 0 ]]; do
             ANSIBLE_S3_BUCKET="$2"
             shift 2
             ;;
+        --secrets-extension-layer)
+            SECRETS_EXTENSION_LAYER_ARN="$2"
+            shift 2
+            ;;
         -h|--help)
             echo "Usage: $0 [OPTIONS]"
             echo "Options:"
@@ -56,6 +61,8 @@ while [[ $# -gt 0 ]]; do
             echo "  --deploy-only           Only deploy existing package"
             echo "  --upload-ansible        Upload Ansible playbooks to S3"
             echo "  --ansible-s3-bucket     S3 bucket for Ansible playbooks"
+            echo "  --secrets-extension-layer ARN"
+            echo "                          Attach the AWS Parameters and Secrets Lambda Extension layer"
             echo "  -h, --help              Show this help"
             exit 0
             ;;
@@ -131,6 +138,16 @@ EOF
                 "arn:aws:ssm:*:*:parameter/demoapp/*"
             ]
         },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "secretsmanager:GetSecretValue",
+                "secretsmanager:DescribeSecret"
+            ],
+            "Resource": [
+                "arn:aws:secretsmanager:*:*:secret:demoapp/vm/*"
+            ]
+        },
         {
             "Effect": "Allow",
             "Action": [
@@ -207,6 +224,7 @@ package_lambda() {
 
     # Copy Python sources
     cp ansible_lambda.py "$TEMP_DIR/"
+    cp playbook_runner.py "$TEMP_DIR/"
     cp deployment_lambda.py "$TEMP_DIR/" 2>/dev/null || true
 
     # Embed ansible directory
@@ -228,6 +246,18 @@ package_lambda() {
             --target "$TEMP_DIR" -r requirements.txt
     fi
 
+    # Ship bytecode for the Lambda runtime: /var/task is read-only, so any
+    # module without a matching .pyc is recompiled by every ansible-playbook run.
+    # unchecked-hash pycs stay valid even though zip rounds source mtimes; -f
+    # rewrites the timestamp pycs pip already left in site-packages.
+    if command -v python3.11 >/dev/null 2>&1; then
+        log_info "Compiling bytecode for python3.11..."
+        python3.11 -m compileall -q -f -j 0 --invalidation-mode unchecked-hash "$TEMP_DIR" || \
+            log_warn "Bytecode compilation reported errors"
+    else
+        log_warn "python3.11 not found; package will ship without runtime bytecode"
+    fi
+
     # Build zip
     (cd "$TEMP_DIR" && zip -qr ../lambda-deployment.zip .)
     mv "$TEMP_DIR/../lambda-deployment.zip" ./lambda-deployment.zip
@@ -277,13 +307,22 @@ deploy_lambda() {
 
 setup_environment_variables() {
     log_step "Setting environment variables..."
+    local extension_vars=""
+    local layer_args=()
+    if [[ -n "$SECRETS_EXTENSION_LAYER_ARN" ]]; then
+        log_info "Attaching secrets extension layer: $SECRETS_EXTENSION_LAYER_ARN"
+        extension_vars=",\"PARAMETERS_SECRETS_EXTENSION_HTTP_PORT\":\"2773\""
+        layer_args=(--layers "$SECRETS_EXTENSION_LAYER_ARN")
+    fi
     aws lambda update-function-configuration \
       --function-name "$FUNCTION_NAME" \
+      "${layer_args[@]}" \
       --environment Variables="{
         \"AWS_S3_BUCKET_REPOSITORY\":\"${AWS_S3_BUCKET_REPOSITORY:-demoapp-artifacts}\",
         \"LOG_LEVEL\":\"INFO\",
         \"ANSIBLE_STDOUT_CALLBACK\":\"yaml\",
-        \"ANSIBLE_HOST_KEY_CHECKING\":\"False\"
+        \"ANSIBLE_HOST_KEY_CHECKING\":\"False\",
+        \"ANSIBLE_VERBOSITY\":\"${ANSIBLE_VERBOSITY:-0}\"${extension_vars}
       }" || log_warn "Env var update failed"
 }
 
@@ -1,56 +1,171 @@
-import json
 import boto3
+import orjson
+from botocore.config import Config
+from playbook_runner import INVENTORY_TEMPLATE, SSH_COMMON_ARGS, run_streaming, write_extra_vars
 import logging
 import os
-import tempfile
 import base64
 import subprocess
-import shutil
-import zipfile
-from typing import Dict, Any, Optional
-import paramiko
-from io import StringIO
+from typing import Dict, Any, List, Optional, Tuple
 import time
+import urllib.request
+from urllib.parse import quote
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# AWS clients are created once per container and reused by warm invocations;
+# keep-alive connections avoid a fresh TLS handshake per API call
+BOTO_CONFIG = Config(
+    max_pool_connections=25,
+    retries={'max_attempts': 2, 'mode': 'standard'},
+    tcp_keepalive=True
+)
+S3_CLIENT = boto3.client('s3', config=BOTO_CONFIG)
+SSM_CLIENT = boto3.client('ssm', config=BOTO_CONFIG)
+
+# Local HTTP port of the Parameters and Secrets extension, if that layer is attached
+SECRETS_EXTENSION_PORT = os.environ.get('PARAMETERS_SECRETS_EXTENSION_HTTP_PORT')
+
+def extension_get_parameter(parameter_name: str, decrypt: bool = True) -> str:
+    """Get a parameter through the Parameters and Secrets Lambda Extension"""
+    req = urllib.request.Request(
+        f'http://localhost:{SECRETS_EXTENSION_PORT}/systemsmanager/parameters/get'
+        f'?name={quote(parameter_name, safe="")}&withDecryption={str(decrypt).lower()}',
+        headers={'X-Aws-Parameters-Secrets-Token': os.environ['AWS_SESSION_TOKEN']}
+    )
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        return orjson.loads(resp.read())['Parameter']['Value']
+
+# (parameter_name, decrypt) -> (fetched_at, value)
+_PARAMETER_CACHE: Dict[Tuple[str, bool], Tuple[float, str]] = {}
+PARAMETER_CACHE_TTL = 300  # seconds
+
+# Playbooks shipped inside the deployment package (see deploy.sh) are extracted
+# once per container; warm invocations reuse the extracted tree
+ANSIBLE_BUNDLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ansible_bundle.zip')
+ANSIBLE_CACHE_DIR = '/tmp/ansible_cached'
+
+def extract_embedded_ansible() -> Optional[str]:
+    """Extract the embedded Ansible bundle to /tmp unless a previous invocation already did"""
+    ansible_dir = os.path.join(ANSIBLE_CACHE_DIR, 'ansible')
+    sentinel = os.path.join(ANSIBLE_CACHE_DIR, '.extracted')
+    if os.path.exists(sentinel):
+        return ansible_dir
+    if not os.path.isfile(ANSIBLE_BUNDLE):
+        return None
+    import zipfile
+    try:
+        with zipfile.ZipFile(ANSIBLE_BUNDLE, 'r') as zip_ref:
+            zip_ref.extractall(ANSIBLE_CACHE_DIR)
+        if not os.path.isdir(ansible_dir):
+            raise RuntimeError("ansible directory missing after unzip")
+        open(sentinel, 'w').close()
+        logger.info(f"Extracted embedded Ansible bundle to {ansible_dir}")
+        return ansible_dir
+    except Exception as e:
+        logger.warning(f"Could not extract embedded Ansible bundle: {str(e)}")
+        return None
+
+EMBEDDED_ANSIBLE_DIR = extract_embedded_ansible()
+
+# Environment variables for Ansible; static for the container, so built once at import
+BASE_ENV = {
+    **os.environ,
+    'ANSIBLE_HOST_KEY_CHECKING': 'False',
+    'ANSIBLE_STDOUT_CALLBACK': 'yaml',
+    'ANSIBLE_GATHERING': 'explicit',
+    'ANSIBLE_PIPELINING': 'True',
+    'ANSIBLE_SSH_PIPELINING': 'True'
+}
+
+# (key_path, key parameter value) of the SSH key already written in this container
+_SSH_KEY_STATE: Optional[Tuple[str, str]] = None
+
 class AnsibleDeploymentLambda:
     def __init__(self):
-        self.s3_client = boto3.client('s3')
-        self.ssm_client = boto3.client('ssm')
         self.work_dir = None
         
     def get_secret_parameter(self, parameter_name: str, decrypt: bool = True) -> str:
-        """Get parameter from AWS Systems Manager Parameter Store"""
+        """Get parameter from AWS Systems Manager Parameter Store (cached per container)"""
+        cache_key = (parameter_name, decrypt)
+        cached = _PARAMETER_CACHE.get(cache_key)
+        if cached and time.monotonic() - cached[0] < PARAMETER_CACHE_TTL:
+            return cached[1]
         try:
-            response = self.ssm_client.get_parameter(
-                Name=parameter_name,
-                WithDecryption=decrypt
-            )
-            return response['Parameter']['Value']
+            if SECRETS_EXTENSION_PORT:
+                value = extension_get_parameter(parameter_name, decrypt)
+            else:
+                response = SSM_CLIENT.get_parameter(
+                    Name=parameter_name,
+                    WithDecryption=decrypt
+                )
+                value = response['Parameter']['Value']
+            _PARAMETER_CACHE[cache_key] = (time.monotonic(), value)
+            return value
         except Exception as e:
             logger.error(f"Error retrieving parameter {parameter_name}: {str(e)}")
             raise
+
+    def get_secret_parameters(self, parameter_names: List[str]) -> Dict[str, str]:
+        """Get several decrypted parameters with a single GetParameters call (cached per container)"""
+        values = {}
+        missing = []
+        for name in parameter_names:
+            cached = _PARAMETER_CACHE.get((name, True))
+            if cached and time.monotonic() - cached[0] < PARAMETER_CACHE_TTL:
+                values[name] = cached[1]
+            else:
+                missing.append(name)
+        if not missing:
+            return values
+
+        if SECRETS_EXTENSION_PORT:
+            # The extension serves single parameters from its local cache
+            for name in missing:
+                values[name] = self.get_secret_parameter(name, decrypt=True)
+            return values
+
+        # GetParameters accepts at most 10 names per call
+        for i in range(0, len(missing), 10):
+            batch = missing[i:i + 10]
+            response = SSM_CLIENT.get_parameters(Names=batch, WithDecryption=True)
+            if response.get('InvalidParameters'):
+                invalid = ', '.join(response['InvalidParameters'])
+                logger.error(f"Parameters not found: {invalid}")
+                raise KeyError(f"Parameters not found: {invalid}")
+            fetched_at = time.monotonic()
+            for parameter in response['Parameters']:
+                values[parameter['Name']] = parameter['Value']
+                _PARAMETER_CACHE[(parameter['Name'], True)] = (fetched_at, parameter['Value'])
+        return values
     
     def setup_work_directory(self) -> str:
         """Create and setup work directory for Ansible execution"""
+        import tempfile
         self.work_dir = tempfile.mkdtemp(prefix='ansible_deploy_')
         logger.info(f"Created work directory: {self.work_dir}")
         return self.work_dir
     
-    def download_ansible_package(self, ansible_s3_bucket: str, ansible_s3_key: str) -> str:
-        """Download and extract Ansible package from S3"""
+    def download_ansible_package(self, ansible_s3_bucket: Optional[str], ansible_s3_key: str) -> str:
+        """Return the embedded Ansible tree, or download and extract the package from S3"""
+        if EMBEDDED_ANSIBLE_DIR:
+            logger.info(f"Using embedded Ansible bundle at {EMBEDDED_ANSIBLE_DIR}")
+            return EMBEDDED_ANSIBLE_DIR
+        if not ansible_s3_bucket:
+            raise ValueError("No embedded Ansible bundle and no ansible_s3_bucket given")
+        import io
+        import zipfile
         try:
-            # Download Ansible package
-            package_path = os.path.join(self.work_dir, 'ansible-package.zip')
-            self.s3_client.download_file(ansible_s3_bucket, ansible_s3_key, package_path)
+            # Download Ansible package into memory (no intermediate file in /tmp)
+            response = S3_CLIENT.get_object(Bucket=ansible_s3_bucket, Key=ansible_s3_key)
+            package_data = io.BytesIO(response['Body'].read())
             logger.info(f"Downloaded Ansible package from s3://{ansible_s3_bucket}/{ansible_s3_key}")
             
             # Extract package
             ansible_dir = os.path.join(self.work_dir, 'ansible')
-            with zipfile.ZipFile(package_path, 'r') as zip_ref:
+            with zipfile.ZipFile(package_data, 'r') as zip_ref:
                 zip_ref.extractall(ansible_dir)
             
             logger.info(f"Extracted Ansible package to {ansible_dir}")
@@ -62,23 +177,19 @@ class AnsibleDeploymentLambda:
     
     def create_inventory_file(self, ansible_dir: str, vm_hostname: str, vm_username: str, site: str) -> str:
         """Create dynamic inventory file for the target environment"""
-        inventory_content = f"""[vm]
-{vm_hostname} ansible_user={vm_username} ansible_connection=ssh ansible_python_interpreter=/usr/libexec/platform-python
-
-[vm:vars]
-ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o IdentitiesOnly=yes'
-site={site}
-"""
-        
         inventory_path = os.path.join(ansible_dir, 'hosts')
         with open(inventory_path, 'w') as f:
-            f.write(inventory_content)
+            f.write(INVENTORY_TEMPLATE.format_map({'host': vm_hostname, 'user': vm_username, 'site': site}))
         
         logger.info(f"Created inventory file: {inventory_path}")
         return inventory_path
     
     def setup_ssh_key(self, ssh_key_content: str) -> str:
-        """Setup SSH key for Ansible connectivity"""
+        """Setup SSH key for Ansible connectivity (written once per container)"""
+        global _SSH_KEY_STATE
+        if _SSH_KEY_STATE and _SSH_KEY_STATE[1] == ssh_key_content and os.path.isfile(_SSH_KEY_STATE[0]):
+            return _SSH_KEY_STATE[0]
+        raw_key_content = ssh_key_content
         ssh_dir = os.path.expanduser('~/.ssh')
         os.makedirs(ssh_dir, exist_ok=True)
         
@@ -97,55 +208,41 @@ site={site}
         
         os.chmod(key_path, 0o600)
         logger.info(f"SSH key setup completed: {key_path}")
+        _SSH_KEY_STATE = (key_path, raw_key_content)
         return key_path
     
     def execute_ansible_playbook(self, ansible_dir: str, inventory_path: str, 
                                  extra_vars: Dict[str, Any]) -> Dict[str, Any]:
         """Execute Ansible playbook"""
+        extra_vars_path = os.path.join(ansible_dir, 'extravars.json')
         try:
-            # Change to ansible directory
-            original_cwd = os.getcwd()
-            os.chdir(ansible_dir)
-            
-            # Set environment variables for Ansible
-            env = os.environ.copy()
-            env['ANSIBLE_HOST_KEY_CHECKING'] = 'False'
-            env['ANSIBLE_STDOUT_CALLBACK'] = 'yaml'
-            env['ANSIBLE_GATHERING'] = 'explicit'
-            
-            # Convert extra_vars to command line format
-            extra_vars_list = []
-            for key, value in extra_vars.items():
-                extra_vars_list.extend(['-e', f'{key}={value}'])
+            # Pass extra_vars as a JSON file (owner-only, it holds credentials)
+            write_extra_vars(ansible_dir, extra_vars)
             
             # Construct ansible-playbook command
             cmd = [
                 'ansible-playbook',
                 '-i', inventory_path,
                 'main.yml',
-                '--ssh-common-args', '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o IdentitiesOnly=yes',
-                '-vvv'
-            ] + extra_vars_list
+                '--ssh-common-args', SSH_COMMON_ARGS,
+                '-e', f'@{extra_vars_path}'
+            ]
             
             logger.info(f"Executing command: {' '.join(cmd)}")
             
             # Execute playbook
-            result = subprocess.run(
+            returncode, stdout, stderr = run_streaming(
                 cmd,
-                capture_output=True,
-                text=True,
-                timeout=900,  # 15 minutes timeout
-                env=env
+                cwd=ansible_dir,
+                env=BASE_ENV,
+                timeout=900  # 15 minutes timeout
             )
             
-            # Restore original directory
-            os.chdir(original_cwd)
-            
             return {
-                'returncode': result.returncode,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'success': result.returncode == 0
+                'returncode': returncode,
+                'stdout': stdout,
+                'stderr': stderr,
+                'success': returncode == 0
             }
             
         except subprocess.TimeoutExpired:
@@ -164,28 +261,25 @@ site={site}
                 'stderr': str(e),
                 'success': False
             }
+        finally:
+            # Holds credentials; don't leave it in the cached tree between invocations
+            if os.path.exists(extra_vars_path):
+                os.remove(extra_vars_path)
     
     def get_inventory_mapping(self, site: str) -> Dict[str, str]:
         """Get VM details from SSM Parameter Store based on site"""
         try:
-            # Get environment-specific parameters
-            hostname = self.get_secret_parameter(f'/demoapp/vm/{site.lower()}/hostname', decrypt=False)
-            username = self.get_secret_parameter(f'/demoapp/vm/{site.lower()}/username', decrypt=False)
-            ssh_key = self.get_secret_parameter(f'/demoapp/vm/ssh-key', decrypt=True)
-            
-            # Get database configuration
-            datasource_url = self.get_secret_parameter(f'/demoapp/vm/{site.lower()}/datasource_url', decrypt=True)
-            db_username = self.get_secret_parameter(f'/demoapp/vm/{site.lower()}/db_username', decrypt=True)
-            db_password = self.get_secret_parameter(f'/demoapp/vm/{site.lower()}/db_password', decrypt=True)
-            
-            return {
-                'hostname': hostname,
-                'username': username,
-                'ssh_key': ssh_key,
-                'datasource_url': datasource_url,
-                'db_username': db_username,
-                'db_password': db_password
+            prefix = f'/demoapp/vm/{site.lower()}'
+            names = {
+                'hostname': f'{prefix}/hostname',
+                'username': f'{prefix}/username',
+                'ssh_key': '/demoapp/vm/ssh-key',
+                'datasource_url': f'{prefix}/datasource_url',
+                'db_username': f'{prefix}/db_username',
+                'db_password': f'{prefix}/db_password'
             }
+            values = self.get_secret_parameters(list(names.values()))
+            return {key: values[name] for key, name in names.items()}
         except Exception as e:
             logger.error(f"Error getting inventory mapping for site {site}: {str(e)}")
             raise ValueError(f"No inventory mapping found for site: {site}")
@@ -193,6 +287,7 @@ site={site}
     def cleanup(self):
         """Cleanup work directory"""
         if self.work_dir and os.path.exists(self.work_dir):
+            import shutil
             shutil.rmtree(self.work_dir)
             logger.info(f"Cleaned up work directory: {self.work_dir}")
 
@@ -201,7 +296,7 @@ def lambda_handler(event, context):
     deployer = None
     try:
         # Parse input parameters
-        body = json.loads(event.get('body', '{}')) if isinstance(event.get('body'), str) else event
+        body = orjson.loads(event.get('body', '{}')) if isinstance(event.get('body'), str) else event
         
         service_name = body.get('service_name')
         jar_timestamp = body.get('jar_timestamp') 
@@ -212,12 +307,12 @@ def lambda_handler(event, context):
         artifacts_s3_bucket = body.get('artifacts_s3_bucket', os.environ.get('AWS_S3_BUCKET_REPOSITORY'))
         
         # Validate required parameters
-        if not all([service_name, jar_timestamp, artifacts_s3_bucket, ansible_s3_bucket]):
+        if not all([service_name, jar_timestamp, artifacts_s3_bucket]) or not (EMBEDDED_ANSIBLE_DIR or ansible_s3_bucket):
             return {
                 'statusCode': 400,
-                'body': json.dumps({
+                'body': orjson.dumps({
                     'error': 'Missing required parameters: service_name, jar_timestamp, artifacts_s3_bucket, ansible_s3_bucket'
-                })
+                }).decode()
             }
         
         logger.info(f"Starting Ansible deployment for {service_name} with timestamp {jar_timestamp}")
@@ -235,7 +330,7 @@ def lambda_handler(event, context):
         # Setup SSH key
         ssh_key_path = deployer.setup_ssh_key(inventory['ssh_key'])
         
-        # Download Ansible package
+        # Locate Ansible playbooks (embedded bundle, else S3 package)
         ansible_dir = deployer.download_ansible_package(ansible_s3_bucket, ansible_s3_key)
         
         # Create inventory file
@@ -266,34 +361,34 @@ def lambda_handler(event, context):
             logger.info("Ansible deployment completed successfully!")
             return {
                 'statusCode': 200,
-                'body': json.dumps({
+                'body': orjson.dumps({
                     'message': 'Deployment completed successfully',
                     'service_name': service_name,
                     'timestamp': jar_timestamp,
                     'site': site,
                     'target_vm': inventory['hostname'],
                     'ansible_output': result['stdout'][-2000:]  # Last 2000 chars to avoid size limits
-                })
+                }).decode()
             }
         else:
             logger.error(f"Ansible deployment failed: {result['stderr']}")
             return {
                 'statusCode': 500,
-                'body': json.dumps({
+                'body': orjson.dumps({
                     'error': 'Deployment failed',
                     'ansible_stderr': result['stderr'][-2000:],
                     'ansible_stdout': result['stdout'][-2000:]
-                })
+                }).decode()
             }
             
     except Exception as e:
         logger.error(f"Lambda deployment failed: {str(e)}")
         return {
             'statusCode': 500,
-            'body': json.dumps({
+            'body': orjson.dumps({
                 'error': str(e),
                 'message': 'Lambda deployment failed'
-            })
+            }).decode()
         }
     finally:
         if deployer:
@@ -311,4 +406,4 @@ if __name__ == "__main__":
     }
     
     result = lambda_handler(test_event, None)
-    print(json.dumps(result, indent=2))
+    print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
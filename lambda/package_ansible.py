@@ -15,22 +15,33 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SKIP_DIRS = {'.git', '__pycache__', '.pytest_cache'}
+SKIP_SUFFIXES = ('.pyc', '.pyo', '.DS_Store')
+
+# Already-compressed formats gain nothing from deflate; store them as-is
+STORED_SUFFIXES = ('.zip', '.gz', '.tgz', '.xz', '.bz2', '.jar', '.png', '.jpg', '.jpeg')
+
 def create_ansible_package(ansible_dir: str, output_file: str) -> str:
     """Create ZIP package of Ansible directory"""
     logger.info(f"Creating Ansible package from {ansible_dir}")
     
+    base = os.path.abspath(ansible_dir)
+    # Archive names keep the top-level directory, e.g. ansible/main.yml
+    prefix_len = len(base) - len(os.path.basename(base))
+    
     with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(ansible_dir):
+        for root, dirs, files in os.walk(base):
             # Skip .git and __pycache__ directories
-            dirs[:] = [d for d in dirs if d not in ['.git', '__pycache__', '.pytest_cache']]
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
             
             for file in files:
-                if file.endswith(('.pyc', '.pyo', '.DS_Store')):
+                if file.endswith(SKIP_SUFFIXES):
                     continue
                     
                 file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, os.path.dirname(ansible_dir))
-                zipf.write(file_path, arcname)
+                arcname = file_path[prefix_len:]
+                compress_type = zipfile.ZIP_STORED if file.lower().endswith(STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+                zipf.write(file_path, arcname, compress_type=compress_type)
                 logger.debug(f"Added {arcname} to package")
     
     logger.info(f"Created Ansible package: {output_file}")
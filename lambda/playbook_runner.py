@@ -0,0 +1,85 @@
+"""
+Helpers shared by the Lambda handlers for running ansible-playbook
+(SSH options, inventory template, extra vars file and the subprocess runner)
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, IO, List, Tuple
+
+import orjson
+
+# Reuse one multiplexed SSH connection for every task of a run; the socket
+# lives in /tmp because $HOME is read-only on Lambda
+SSH_COMMON_ARGS = (
+    "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o IdentitiesOnly=yes "
+    "-o ControlMaster=auto -o ControlPersist=60s -o ControlPath=/tmp/ansible-%r@%h:%p"
+)
+
+# Only host, user and site vary per invocation; the SSH args are baked in once
+INVENTORY_TEMPLATE = (
+    "[vm]\n"
+    "{host} ansible_user={user} ansible_connection=ssh ansible_python_interpreter=/usr/libexec/platform-python\n"
+    "\n"
+    "[vm:vars]\n"
+    "site={site}\n"
+    "ansible_ssh_common_args=" + SSH_COMMON_ARGS + "\n"
+)
+
+# Lines of ansible-playbook stdout/stderr kept per stream
+OUTPUT_TAIL_LINES = 500
+
+def write_extra_vars(ansible_dir: str, extra: Dict[str, Any]) -> str:
+    """Write extra vars for `-e @file`; owner-only since they hold credentials"""
+    path = os.path.join(ansible_dir, "extravars.json")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(orjson.dumps(extra))
+    return path
+
+def _drain(stream: IO[str], tail: deque) -> None:
+    # The reader must never stop early: a child blocked on a full pipe would
+    # hang until the timeout, so fall back to raw bytes if decoding fails
+    try:
+        for line in stream:
+            tail.append(line)
+    except ValueError:
+        for raw in stream.buffer:
+            tail.append(raw.decode("utf-8", "replace"))
+    finally:
+        stream.close()
+
+def run_streaming(cmd: List[str], cwd: str, env: Dict[str, str], timeout: int) -> Tuple[int, str, str]:
+    """Run a command keeping only the tail of its output, so memory stays bounded"""
+    # One deadline covers the process and its pipes: anything that inherited
+    # them (forked workers, backgrounded commands) must not outlive the timeout
+    deadline = time.monotonic() + timeout
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            encoding="utf-8", errors="replace", bufsize=1, start_new_session=True)
+    stdout_tail, stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES), deque(maxlen=OUTPUT_TAIL_LINES)
+    readers = [
+        threading.Thread(target=_drain, args=(proc.stdout, stdout_tail), daemon=True),
+        threading.Thread(target=_drain, args=(proc.stderr, stderr_tail), daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        proc.wait(timeout=timeout)
+        for reader in readers:
+            reader.join(max(0, deadline - time.monotonic()))
+        if any(reader.is_alive() for reader in readers):
+            raise subprocess.TimeoutExpired(cmd, timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+        for reader in readers:
+            reader.join(5)
+        raise
+    return proc.returncode, "".join(stdout_tail), "".join(stderr_tail)